@@ -0,0 +1,1116 @@
+from micropython import const
+import framebuf
+from machine import Pin, SoftI2C, SPI, WDT, mem32
+import time
+import utime
+import os
+import sys
+import select
+import struct
+from array import array
+from binascii import crc32
+from mfrc522 import MFRC522
+from keypad import Keypad
+import _thread
+
+# register definitions
+SET_CONTRAST        = const(0x81)
+SET_ENTIRE_ON       = const(0xa4)
+SET_NORM_INV        = const(0xa6)
+SET_DISP            = const(0xae)
+SET_MEM_ADDR        = const(0x20)
+SET_COL_ADDR        = const(0x21)
+SET_PAGE_ADDR       = const(0x22)
+SET_DISP_START_LINE = const(0x40)
+SET_SEG_REMAP       = const(0xa0)
+SET_MUX_RATIO       = const(0xa8)
+SET_COM_OUT_DIR     = const(0xc0)
+SET_DISP_OFFSET     = const(0xd3)
+SET_COM_PIN_CFG     = const(0xda)
+SET_DISP_CLK_DIV    = const(0xd5)
+SET_PRECHARGE       = const(0xd9)
+SET_VCOM_DESEL      = const(0xdb)
+SET_CHARGE_PUMP     = const(0x8d)
+
+
+class Font:
+    # Pre-rasterized glyphs made by tools/mkfont.py. Glyphs are MONO_VLSB
+    # column bytes page by page, the SSD1306 buffer layout, so drawing is a
+    # slice copy per page. The file is read on first use.
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.height = 0
+        self.glyphs = {} # char: (width, offset)
+
+    def load(self):
+        if self.data == None:
+            self.data = b""
+            try:
+                with open(self.path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                return False
+            if data[0:3] != b"MF\x01":
+                return False
+            self.height = data[3]
+            count = data[4]
+            start = 5 + count * 4
+            for i in range(count):
+                entry = 5 + i * 4
+                self.glyphs[chr(data[entry])] = (data[entry + 1], start + data[entry + 2] + (data[entry + 3] << 8))
+            self.data = data
+        return len(self.data) > 0
+
+    def has(self, text):
+        if not self.load():
+            return False
+        for char in text:
+            if char not in self.glyphs:
+                return False
+        return True
+
+    def draw(self, buffer, buffer_width, buffer_pages, text, x, page):
+        # returns x after the text, glyphs are clipped at the buffer edges
+        data = memoryview(self.data)
+        pages = min(self.height // 8, buffer_pages - page)
+        for char in text:
+            (width, offset) = self.glyphs[char]
+            n = min(width, buffer_width - x)
+            if n <= 0:
+                break
+            for p in range(pages):
+                dst = (page + p) * buffer_width + x
+                src = offset + p * width
+                buffer[dst:dst + n] = data[src:src + n]
+            x += width
+        return x
+
+
+class SSD1306:
+    def __init__(self, width, height, external_vcc, on=True):
+        self.width = width
+        self.height = height
+        self.external_vcc = external_vcc
+        self.pages = self.height // 8
+        self.buffer = bytearray(self.pages * self.width)
+        fb = framebuf.FrameBuffer(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
+        self.framebuf = fb
+        # Provide methods for accessing FrameBuffer graphics primitives. This is a
+        # workround because inheritance from a native class is currently unsupported.
+        # http://docs.micropython.org/en/latest/pyboard/library/framebuf.html
+        self.fill = fb.fill
+        self.pixel = fb.pixel
+        self.hline = fb.hline
+        self.vline = fb.vline
+        self.line = fb.line
+        self.rect = fb.rect
+        self.fill_rect = fb.fill_rect
+        self.text = fb.text
+        self.scroll = fb.scroll
+        self.blit = fb.blit
+        self.init_display(on)
+
+    def init_display(self, on=True):
+        # with on=False the panel stays dark and uncleared, the caller draws
+        # the first frame, shows it and then calls poweron()
+        self.write_cmds(bytes((
+            SET_DISP | 0x00, # off
+            # address setting
+            SET_MEM_ADDR, 0x00, # horizontal
+            # resolution and layout
+            SET_DISP_START_LINE | 0x00,
+            SET_SEG_REMAP | 0x01, # column addr 127 mapped to SEG0
+            SET_MUX_RATIO, self.height - 1,
+            SET_COM_OUT_DIR | 0x08, # scan from COM[N] to COM0
+            SET_DISP_OFFSET, 0x00,
+            SET_COM_PIN_CFG, 0x02 if self.height == 32 else 0x12,
+            # timing and driving scheme
+            SET_DISP_CLK_DIV, 0x80,
+            SET_PRECHARGE, 0x22 if self.external_vcc else 0xf1,
+            SET_VCOM_DESEL, 0x30, # 0.83*Vcc
+            # display
+            SET_CONTRAST, 0xff, # maximum
+            SET_ENTIRE_ON, # output follows RAM contents
+            SET_NORM_INV, # not inverted
+            # charge pump
+            SET_CHARGE_PUMP, 0x10 if self.external_vcc else 0x14)))
+        if on:
+            self.fill(0)
+            self.show()
+            self.poweron()
+
+    def poweroff(self):
+        self.write_cmd(SET_DISP | 0x00)
+
+    def poweron(self):
+        self.write_cmd(SET_DISP | 0x01)
+
+    def contrast(self, contrast):
+        self.write_cmd(SET_CONTRAST)
+        self.write_cmd(contrast)
+
+    def invert(self, invert):
+        self.write_cmd(SET_NORM_INV | (invert & 1))
+
+    def show(self):
+        x0 = 0
+        x1 = self.width - 1
+        if self.width == 64:
+            # displays with width of 64 pixels are shifted by 32
+            x0 += 32
+            x1 += 32
+        self.write_cmds(bytes((SET_COL_ADDR, x0, x1, SET_PAGE_ADDR, 0, self.pages - 1)))
+        self.write_data(self.buffer)
+
+    def show_pages(self, first, last):
+        # flush only pages first..last, one page is one 8px text row
+        x0 = 0
+        x1 = self.width - 1
+        if self.width == 64:
+            x0 += 32
+            x1 += 32
+        self.write_cmds(bytes((SET_COL_ADDR, x0, x1, SET_PAGE_ADDR, first, last)))
+        self.write_data(memoryview(self.buffer)[first * self.width:(last + 1) * self.width])
+        
+    def write_font(self, font, text, x, y):
+        # blit text in a pre-rasterized font, y is rounded down to a page,
+        # returns False if the font file or a glyph is missing
+        if not font.has(text):
+            return False
+        font.draw(self.buffer, self.width, self.pages, text, x, y // 8)
+        return True
+
+    def write_text(self, text, x, y, size):
+        ''' Method to write Text on OLED/LCD Displays with a variable font size
+
+            Args:
+                text: the string of chars to be displayed
+                x: x co-ordinate of starting position
+                y: y co-ordinate of starting position
+                size: font size of text
+                color: color of text to be displayed
+        '''
+        background = 0
+        # clear screen
+        #self.fill(background)
+        info = []
+        # Creating reference characters to read their values
+        self.text(text, x, y)
+        for i in range(x, x + (8 * len(text))):
+            for j in range(y, y + 8):
+                # Fetching and saving details of pixels, such as
+                # x co-ordinate, y co-ordinate, and color of the pixel
+                px_color = self.pixel(i, j)                
+                info.append((i, j, px_color))
+        # Clearing the reference characters from the screen
+        self.text(text, x, y, background)        
+        # Writing the custom-sized font characters on screen
+        for px_info in info:
+            self.fill_rect(size * px_info[0] - (size - 1) * x,
+                           size * px_info[1] - (size - 1) * y,
+                           size, size, px_info[2])        
+
+
+class SSD1306_I2C(SSD1306):
+    def __init__(self, width, height, i2c, addr=0x3c, external_vcc=False, on=True):
+        self.i2c = i2c
+        self.addr = addr
+        self.temp = bytearray(2)
+        super().__init__(width, height, external_vcc, on)
+
+    def write_cmd(self, cmd):
+        self.temp[0] = 0x80 # Co=1, D/C#=0
+        self.temp[1] = cmd
+        self.i2c.writeto(self.addr, self.temp)
+
+    def write_cmds(self, cmds):
+        # one transaction for the whole command stream
+        self.temp[0] = self.addr << 1
+        self.temp[1] = 0x00 # Co=0, D/C#=0
+        self.i2c.start()
+        self.i2c.write(self.temp)
+        self.i2c.write(cmds)
+        self.i2c.stop()
+
+    def write_data(self, buf):
+        self.temp[0] = self.addr << 1
+        self.temp[1] = 0x40 # Co=0, D/C#=1
+        self.i2c.start()
+        self.i2c.write(self.temp)
+        self.i2c.write(buf)
+        self.i2c.stop()
+
+
+class SSD1306_SPI(SSD1306):
+    def __init__(self, width, height, spi, dc, res, cs, external_vcc=False, on=True):
+        self.rate = 10 * 1024 * 1024
+        dc.init(dc.OUT, value=0)
+        res.init(res.OUT, value=0)
+        cs.init(cs.OUT, value=1)
+        self.spi = spi
+        self.dc = dc
+        self.res = res
+        self.cs = cs
+        import time
+        self.res(1)
+        time.sleep_ms(1)
+        self.res(0)
+        time.sleep_ms(10)
+        self.res(1)
+        super().__init__(width, height, external_vcc, on)
+
+    def write_cmd(self, cmd):
+        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        self.cs(1)
+        self.dc(0)
+        self.cs(0)
+        self.spi.write(bytearray([cmd]))
+        self.cs(1)
+
+    def write_cmds(self, cmds):
+        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        self.cs(1)
+        self.dc(0)
+        self.cs(0)
+        self.spi.write(cmds)
+        self.cs(1)
+
+    def write_data(self, buf):
+        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        self.cs(1)
+        self.dc(1)
+        self.cs(0)
+        self.spi.write(buf)
+        self.cs(1)
+        
+        
+SCROLL_MS = 4000
+HISTORY = const(80) # balance samples per player, one sparkline pixel each
+MAX_PLAYERS = const(32) # the history alone is players * HISTORY * 4 bytes of heap
+STATS_ROWS = const(4) # players on a stats page, 16px each
+MAX_DIGITS = const(5)
+# while an amount is typed these keys append zeros: x10, x100, x1000
+MULTIPLIERS = {"*": 1, "#": 2, "B": 3}
+WDT_MS = 5000
+
+# rp2040 WATCHDOG_BASE + SCRATCH0, scratch registers 0-3 are not used by the
+# firmware and keep their value over watchdog and soft resets
+SCRATCH = const(0x4005800c)
+JOURNAL_MAGIC = const(0x4d42)
+
+# in-flight operations
+OP_NONE = const(0)
+OP_HOLD = const(1) # trade: payer tapped, waiting for the receiver
+OP_PLUS = const(2)
+OP_MINUS = const(3)
+OP_TRADE = const(4)
+OP_RESET = const(5) # ledger only: new game, a is the player count
+
+
+class Journal:
+    # Record of the in-flight transaction kept in the watchdog scratch
+    # registers, writing it costs no flash. A power loss clears it, but the
+    # balances are only changed in RAM together with an atomic save, so
+    # there is nothing to recover then.
+    #   SCRATCH0: magic << 16 | op << 8 | check
+    #   SCRATCH1: amount
+    #   SCRATCH2: ledger index & 0xffff << 16 | player a << 8 | player b
+    #   SCRATCH3: balance of player a before the operation
+
+    def _check(self, op, amount, ab, before):
+        x = amount ^ ab ^ before
+        return (x ^ (x >> 8) ^ (x >> 16) ^ (x >> 24) ^ op) & 0xff
+
+    def write(self, op, amount, a, b, before, index=0):
+        ab = ((index & 0xffff) << 16) | (a << 8) | b
+        mem32[SCRATCH + 4] = amount
+        mem32[SCRATCH + 8] = ab
+        mem32[SCRATCH + 12] = before
+        # header last, the record is valid only when it is complete
+        mem32[SCRATCH] = (JOURNAL_MAGIC << 16) | (op << 8) | self._check(op, amount, ab, before)
+
+    def read(self):
+        # (op, amount, a, b, before, ledger index), op is OP_NONE if there is
+        # no valid record
+        head = mem32[SCRATCH] & 0xffffffff
+        amount = mem32[SCRATCH + 4] & 0xffffffff
+        ab = mem32[SCRATCH + 8] & 0xffffffff
+        before = mem32[SCRATCH + 12] & 0xffffffff
+        op = (head >> 8) & 0xff
+        if (head >> 16) != JOURNAL_MAGIC or (head & 0xff) != self._check(op, amount, ab, before):
+            return OP_NONE, 0, 0, 0, 0, 0
+        return op, amount, (ab >> 8) & 0xff, ab & 0xff, before, ab >> 16
+
+    def clear(self):
+        mem32[SCRATCH] = 0
+
+
+LEDGER_VERSION = const(1)
+LEDGER_RECORD = const(16)
+LEDGER_CHUNK = const(256) # ledger bytes per serial frame
+
+# serial frames: b"MB", type u8, payload length u16, payload, crc32 u32 of
+# type, length and payload, all little endian
+FRAME_HEADER = const(1)
+FRAME_SNAPSHOT = const(2)
+FRAME_LEDGER = const(3)
+FRAME_END = const(4)
+
+
+class Ledger:
+    # Append-only transaction log in ledger.bin, LEDGER_RECORD bytes per
+    # record: index u32, time u32, amount i32, op u8, player a u8,
+    # player b u8, keys u8. A zero record (op 0) is padding.
+    def __init__(self, path='ledger.bin'):
+        self.path = path
+        self.enabled = True
+        self.count = 0
+        self.record = bytearray(LEDGER_RECORD)
+
+    def open(self):
+        try:
+            size = os.stat(self.path)[6]
+        except OSError:
+            size = 0
+        if size % LEDGER_RECORD:
+            # append torn by a reset, pad it up to a record boundary
+            with open(self.path, 'ab') as f:
+                f.write(bytes(LEDGER_RECORD - size % LEDGER_RECORD))
+            size = size + LEDGER_RECORD - size % LEDGER_RECORD
+        self.count = size // LEDGER_RECORD
+
+    def op_at(self, index):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(index * LEDGER_RECORD + 12)
+                data = f.read(1)
+        except OSError:
+            return 0
+        return data[0] if data else 0
+
+    def append(self, op, amount, a, b, keys):
+        if not self.enabled:
+            return
+        struct.pack_into("<IIiBBBB", self.record, 0, self.count, time.time(), amount, op, a, b, min(keys, 255))
+        with open(self.path, 'ab') as f:
+            f.write(self.record)
+        self.count += 1
+
+
+MAILBOX_SLOTS = const(8)
+MAILBOX_UID = const(10) # longest ISO 14443 uid
+CARD_GONE_POLLS = const(4) # empty polls before the same card counts as a new tap
+
+
+class Mailbox:
+    # Single-producer/single-consumer ring of card uids between the cores.
+    # Fixed size and allocation free: a slot is a length byte followed by
+    # the uid, the producer only moves head and the consumer only tail.
+    def __init__(self):
+        self.buffer = bytearray(MAILBOX_SLOTS * (MAILBOX_UID + 1))
+        self.head = 0
+        self.tail = 0
+
+    def put(self, uid):
+        # returns False and drops the uid if the consumer fell behind
+        head = self.head
+        next_head = (head + 1) % MAILBOX_SLOTS
+        if next_head == self.tail:
+            return False
+        offset = head * (MAILBOX_UID + 1)
+        n = min(len(uid), MAILBOX_UID)
+        self.buffer[offset] = n
+        for i in range(n):
+            self.buffer[offset + 1 + i] = uid[i]
+        # publish only after the slot is filled
+        self.head = next_head
+        return True
+
+    def get(self, uid):
+        # copies the oldest uid into bytearray uid, returns its length, 0 if empty
+        tail = self.tail
+        if tail == self.head:
+            return 0
+        offset = tail * (MAILBOX_UID + 1)
+        n = self.buffer[offset]
+        for i in range(n):
+            uid[i] = self.buffer[offset + 1 + i]
+        self.tail = (tail + 1) % MAILBOX_SLOTS
+        return n
+
+
+class Game:
+    def __init__(self, players_count=8, start_balance=1500):
+        self.players_count = players_count
+        self.start_balance = start_balance
+        self.watchdog = True
+        self.rfid_spi = 10000000
+        # "0" and then 1-9 while typing an amount picks a preset
+        self.presets = [200, 50, 100]
+        # created before load_config(), "ledger=0" switches it off
+        self.ledger = Ledger()
+        # card uid: player, "card9=<uid>" lines in config.txt add more
+        self.players_rfid = {"36046426852801053": 0, "36046426852800797": 1, "36046426852800541": 2, "36046426852800285": 3, "36046426852800029": 4, "36046426852799773": 5, "36046426852799517": 6, "36046426852799261": 7}
+        self.load_config()
+        self.players = array('i', [self.start_balance] * self.players_count)
+        
+        self.state_game = "" # "" "plus1" "plus2" "minus1" "minus2" "trade1" "trade2" "trade3" "trade4"
+        self.number = ""
+        
+        # Peripherals are created in boot()
+        self.oled = None
+        self.rfid_reader = None
+        self.keypad = None
+        # (stage, ticks_us) pairs, ticks_us counts from the board reset
+        self.boot_times = []
+
+        # last committed operation for repeat, key presses since the last commit
+        self.last_op = OP_NONE
+        self.last_amount = 0
+        self.key_presses = 0
+
+        self.journal = Journal()
+        # serial commands, see run_command()
+        self.serial = select.poll()
+        self.serial.register(sys.stdin, select.POLLIN)
+        self.command = ""
+        self.frame_head = bytearray(5)
+        self.frame_crc = bytearray(4)
+        self.chunk = bytearray(LEDGER_CHUNK)
+        self.save_player_id_trade = -1
+        self.wdt = None
+        self.rfid_beat = time.ticks_ms()
+
+        # card uids from the RFID thread
+        self.mailbox = Mailbox()
+        self.card_buf = bytearray(MAILBOX_UID)
+
+        self.oled_width = 128
+        self.oled_height = 64
+        self.rows = self.oled_height // 8
+        self.pages = (self.players_count + self.rows - 1) // self.rows
+        self.page = 0
+        self.page_time = time.ticks_ms()
+        # text of every scoreboard row on the screen, None if scoreboard is not shown
+        self.rows_cache = None
+        # stats page on the screen, -1 if stats are not shown
+        self.stats_page = -1
+        # amount entry screen is on, typing redraws only its text band
+        self.entry_shown = False
+        self.stats_pages = (self.players_count + STATS_ROWS - 1) // STATS_ROWS
+
+        # balance ring buffers, player i owns history[i * HISTORY:(i + 1) * HISTORY]
+        self.history = array('i', [0] * (self.players_count * HISTORY))
+        self.history_head = 0
+        self.history_count = 0
+        # large text, write_text scaling is used if a font file is missing
+        self.fonts = {2: Font('font16.bin'), 3: Font('font24.bin')}
+
+    def boot_stage(self, stage):
+        self.boot_times.append((stage, time.ticks_us()))
+
+    def boot(self):
+        # First frame as early as possible: the panel is initialized dark,
+        # the scoreboard is drawn into its buffer and shown with one flush.
+        self.boot_stage("start")
+        self.ledger.open()
+        self.load_from_file()
+        self.recover()
+        self.sample()
+        self.boot_stage("save")
+
+        # Oled
+        self.i2c = SoftI2C(sda=Pin(0), scl=Pin(1))
+        self.oled = SSD1306_I2C(self.oled_width, self.oled_height, self.i2c, on=False)
+        self.boot_stage("oled")
+        if self.state_game == "trade3":
+            self.show_score_one_number(self.players[self.save_player_id_trade] - int(self.number[:-1]))
+        else:
+            self.show_score_all()
+        self.oled.poweron()
+        self.boot_stage("frame")
+
+        self.init_keypad()
+        self.boot_stage("keypad")
+
+        # RFID is created by its own thread on the second core, MFRC522
+        # constructor already resets and initializes the chip
+        self.rfid_beat = time.ticks_ms()
+        _thread.start_new_thread(self.rfid_thread, ())
+
+    def init_keypad(self):
+        # Define GPIO pins for rows
+        self.row_pins = [Pin(13),Pin(12),Pin(11),Pin(10)]
+        # Define GPIO pins for columns
+        self.column_pins = [Pin(9),Pin(8),Pin(3),Pin(2)]
+        # Define keypad layout
+        self.keys = [
+            ['1', '2', '3', 'A'],
+            ['4', '5', '6', 'B'],
+            ['7', '8', '9', 'C'],
+            ['*', '0', '#', 'D']]
+
+        self.keypad = Keypad(self.row_pins, self.column_pins, self.keys)
+
+    def load_config(self):
+        # config.txt: "players=12", "balance=1500", "card9=<uid>",
+        # "watchdog=0", "rfid_spi=4000000", "presets=200,50,100" and
+        # "ledger=0", one per line, all optional
+        try:
+            with open('config.txt', 'r') as f:
+                for line in f:
+                    key, _, value = line.strip().partition("=")
+                    try:
+                        self.config_line(key, value)
+                    except ValueError:
+                        # typo in a value, the default stays
+                        print(f"config.txt: bad line {line.strip()}")
+        except OSError:
+            pass
+
+    def config_line(self, key, value):
+        if key == "players":
+            players_count = int(value)
+            if players_count < 1 or players_count > MAX_PLAYERS:
+                raise ValueError
+            self.players_count = players_count
+        elif key == "balance":
+            self.start_balance = int(value)
+        elif key.startswith("card"):
+            player = int(key[4:]) - 1
+            if player < 0 or player >= MAX_PLAYERS or value == "":
+                raise ValueError
+            self.players_rfid[value] = player
+        elif key == "watchdog":
+            self.watchdog = value != "0"
+        elif key == "rfid_spi":
+            self.rfid_spi = int(value)
+        elif key == "presets":
+            presets = [int(v) for v in value.split(",") if v]
+            for preset in presets:
+                if preset < 0 or len(str(preset)) > MAX_DIGITS:
+                    raise ValueError
+            self.presets = presets
+        elif key == "ledger":
+            self.ledger.enabled = value != "0"
+
+    def load_from_file(self):
+        try:
+            with open('save.txt', 'r') as f:
+                for i in range(0, self.players_count):
+                    line = f.readline()
+                    if line == "":
+                        # save from a game with fewer players
+                        break
+                    self.players[i] = int(line)
+        except:
+            self.reset_players()
+
+    def save_to_file(self):
+        # rename is atomic on littlefs, a reset never leaves a half written save.txt
+        with open('save.tmp', 'w') as f:
+            for i in range(0, self.players_count):
+                f.write(f"{self.players[i]}\n")
+        os.rename('save.tmp', 'save.txt')
+
+    def apply(self, op, amount, a, b):
+        if op == OP_PLUS:
+            self.players[a] = self.players[a] + amount
+        elif op == OP_MINUS:
+            self.players[a] = self.players[a] - amount
+        elif op == OP_TRADE:
+            self.players[a] = self.players[a] - amount
+            self.players[b] = self.players[b] + amount
+
+    def commit(self, op, amount, a, b=0):
+        self.journal.write(op, amount, a, b, self.players[a], self.ledger.count)
+        self.apply(op, amount, a, b)
+        self.save_to_file()
+        # the journal keeps the ledger index, recover() appends if this is lost
+        self.ledger.append(op, amount, a, b, self.key_presses)
+        self.journal.clear()
+        self.sample()
+        self.last_op = op
+        self.last_amount = amount
+        # session log on the USB serial, keys per transaction
+        print(f"tx op={op} amount={amount} keys={self.key_presses}")
+        self.key_presses = 0
+
+    def sample(self):
+        # one balance sample per player, no allocations
+        head = self.history_head
+        for i in range(0, self.players_count):
+            self.history[i * HISTORY + head] = self.players[i]
+        self.history_head = (head + 1) % HISTORY
+        if self.history_count < HISTORY:
+            self.history_count += 1
+
+    def recover(self):
+        # finish or drop the operation interrupted by a reset
+        (op, amount, a, b, before, index) = self.journal.read()
+        if op == OP_NONE:
+            return
+        if a >= self.players_count or b >= self.players_count:
+            self.journal.clear()
+        elif op == OP_HOLD:
+            # payer already tapped, wait for the receiver again
+            self.save_player_id_trade = a
+            self.number = f"{amount}A"
+            self.state_game = "trade3"
+        else:
+            # unchanged balance means the save did not land, roll forward
+            if self.players[a] == before:
+                self.apply(op, amount, a, b)
+                self.save_to_file()
+            # the commit's record is the last one if its append landed, a
+            # torn append was padded with an op 0 record by ledger.open()
+            last = self.ledger.count - 1
+            if last < 0 or (last & 0xffff) != index or self.ledger.op_at(last) != op:
+                self.ledger.append(op, amount, a, b, 0)
+            self.journal.clear()
+
+    def cancel_hold(self):
+        if self.state_game == "trade3":
+            self.journal.clear()
+
+    def reset_players(self):
+        for i in range(0, self.players_count):
+            self.players[i] = self.start_balance
+        self.save_to_file()
+        self.ledger.append(OP_RESET, self.start_balance, self.players_count, 0, self.key_presses)
+        self.key_presses = 0
+        # a new game starts a new history
+        self.history_count = 0
+        self.sample()
+                
+    def handle_key(self, key_pressed):
+        self.key_presses += 1
+        if self.state_game in ("plus1", "minus1", "trade1"):
+            if self.number != "" and key_pressed in MULTIPLIERS: #x10 x100 x1000
+                self.enter_digits("0" * MULTIPLIERS[key_pressed])
+                return
+            if self.number == "0" and key_pressed in "123456789" and int(key_pressed) <= len(self.presets): #preset
+                preset = str(self.presets[int(key_pressed) - 1])
+                if len(preset) <= MAX_DIGITS:
+                    self.number = ""
+                    self.enter_digits(preset)
+                return
+        if key_pressed == "A" and self.state_game == "" and self.last_op != OP_NONE: #repeat last
+            self.number = f"{self.last_amount}A"
+            if self.last_op == OP_PLUS:
+                self.state_game = "plus2"
+                self.show_plus(self.number)
+            elif self.last_op == OP_MINUS:
+                self.state_game = "minus2"
+                self.show_minus(self.number)
+            else:
+                self.state_game = "trade2"
+                self.show_trade(self.number)
+            return
+        if key_pressed == "D" and self.state_game == "": #next page, scoreboard then stats
+            self.page_time = time.ticks_ms()
+            if self.stats_page >= 0:
+                if self.stats_page + 1 < self.stats_pages:
+                    self.show_stats(self.stats_page + 1)
+                else:
+                    self.show_score_all(0)
+            elif self.rows_cache == None:
+                self.show_score_all()
+            elif self.page + 1 < self.pages:
+                self.show_score_all(self.page + 1)
+            else:
+                self.show_stats(0)
+        if key_pressed == "D": #trade
+            if self.state_game == "trade1" and len(self.number) > 0:
+                self.number = self.number[:-1]
+                self.show_trade(self.number)
+            if self.state_game == "minus1" and len(self.number) > 0:
+                self.number = self.number[:-1]
+                self.show_minus(self.number)
+            if self.state_game == "plus1" and len(self.number) > 0:
+                self.number = self.number[:-1]
+                self.show_plus(self.number)
+        if key_pressed == "B": #trade
+            self.cancel_hold()
+            self.number = ""
+            self.state_game = "trade1"
+            self.show_trade(self.number)
+        if key_pressed == "C": #break
+            self.cancel_hold()
+            self.show_score_all()
+            self.state_game = ""
+            self.number = ""
+        if key_pressed == "#": #minus
+            self.cancel_hold()
+            self.number = ""
+            self.state_game = "minus1"
+            self.show_minus(self.number)
+        if key_pressed == "*": #plus
+            self.cancel_hold()
+            self.number = ""
+            self.state_game = "plus1"
+            self.show_plus(self.number)
+        if key_pressed in ("0", "1", "2", "3", "4", "5", "6", "7", "8", "9"):
+            if self.state_game == "plus1" and len(self.number) < MAX_DIGITS:
+                self.number = self.number + key_pressed
+                self.show_plus(self.number)
+            if self.state_game == "minus1" and len(self.number) < MAX_DIGITS:
+                self.number = self.number + key_pressed
+                self.show_minus(self.number)
+            if self.state_game == "trade1" and len(self.number) < MAX_DIGITS:
+                self.number = self.number + key_pressed
+                self.show_trade(self.number)
+        if key_pressed == "A": #approve
+            if self.state_game == "plus1":
+                if self.number != "":
+                    self.state_game = "plus2"
+                    self.number = self.number + "A"
+                    self.show_plus(self.number)
+                else:
+                    self.show_score_all()
+                    self.state_game = ""
+                    self.number = ""
+            if self.state_game == "minus1":
+                if self.number != "":
+                    self.state_game = "minus2"
+                    self.number = self.number + "A"
+                    self.show_minus(self.number)
+                else:
+                    self.show_score_all()
+                    self.state_game = ""
+                    self.number = ""
+            if self.state_game == "trade1":
+                if self.number != "":
+                    self.state_game = "trade2"
+                    self.number = self.number + "A"
+                    self.show_trade(self.number)
+                    #restore game
+                    if self.number == "99123A":
+                        self.reset_players()
+                        self.number = ""
+                        self.state_game = ""
+                        self.show_score_all()
+                else:
+                    self.show_score_all()
+                    self.state_game = ""
+                    self.number = ""
+
+    def enter_digits(self, digits):
+        if len(self.number) + len(digits) > MAX_DIGITS:
+            return
+        self.number = self.number + digits
+        if self.state_game == "plus1":
+            self.show_plus(self.number)
+        elif self.state_game == "minus1":
+            self.show_minus(self.number)
+        else:
+            self.show_trade(self.number)
+
+    def handle_card(self, player_id):
+        if self.state_game == "plus2":
+            self.commit(OP_PLUS, int(self.number[:-1]), player_id)
+            self.state_game = ""
+            self.number = ""
+            self.show_score_one(player_id)
+        elif self.state_game == "minus2":
+            if (self.players[player_id] - int(self.number[:-1])) >= 0:
+                self.commit(OP_MINUS, int(self.number[:-1]), player_id)
+                self.state_game = ""
+                self.number = ""
+                self.show_score_one(player_id)
+            else:
+                self.show_not_enough(self.players[player_id] - int(self.number[:-1]))
+                self.state_game = ""
+                self.number = ""
+        elif self.state_game == "trade2":
+            if (self.players[player_id] - int(self.number[:-1])) >= 0:
+                self.save_player_id_trade = player_id
+                self.journal.write(OP_HOLD, int(self.number[:-1]), player_id, 0, self.players[player_id])
+                self.show_score_one_number((self.players[player_id] - int(self.number[:-1])))
+                self.state_game = "trade3"
+            else:
+                self.show_not_enough(self.players[player_id] - int(self.number[:-1]))
+                self.state_game = ""
+                self.number = ""
+        elif self.state_game == "trade3":
+            # the payer's own card, a second tap or a trade resumed by recover()
+            if player_id == self.save_player_id_trade:
+                return
+            self.commit(OP_TRADE, int(self.number[:-1]), self.save_player_id_trade, player_id)
+            self.state_game = ""
+            self.number = ""
+            self.show_score_one(player_id)
+            self.save_player_id_trade = -1
+        else:
+            self.show_score_one(player_id)
+
+    def rfid_thread(self):
+        # RFID engine on the second core: polling, anticollision and select.
+        # It only publishes card uids to the mailbox, all game state stays
+        # on the first core.
+        # calibrate() initializes the chip, the constructor does not
+        self.rfid_reader = MFRC522(spi_id=0,sck=6,miso=4,mosi=7,cs=5,rst=22,init=False)
+        self.rfid_reader.calibrate(self.rfid_spi)
+        self.boot_stage("rfid")
+        print("boot:", " ".join(f"{stage}={t // 1000}ms" for stage, t in self.boot_times),
+              f"spi={self.rfid_reader.baudrate}")
+        # A card left on the reader is selected again every other poll, so
+        # a uid is published only when it appears, not while it stays.
+        last_card = None
+        missed = 0
+        while True:
+            self.rfid_beat = time.ticks_ms()
+            card_id = None
+            (card_status, tag_type) = self.rfid_reader.request(self.rfid_reader.REQIDL)
+            if card_status == self.rfid_reader.OK:
+                (card_status, card_id) = self.rfid_reader.SelectTagSN()
+                if card_status != self.rfid_reader.OK:
+                    card_id = None
+            if card_id == None:
+                missed += 1
+                if missed >= CARD_GONE_POLLS:
+                    last_card = None
+            else:
+                missed = 0
+                if card_id != last_card:
+                    last_card = card_id
+                    self.mailbox.put(card_id)
+
+    def run_game(self):
+        self.boot()
+        if self.watchdog:
+            self.wdt = WDT(timeout=WDT_MS)
+        state = False
+        while True:
+            # the board resets if either core hangs
+            if self.wdt != None and time.ticks_diff(time.ticks_ms(), self.rfid_beat) < WDT_MS:
+                self.wdt.feed()
+            key_pressed = self.keypad.read_keypad()
+            if (key_pressed != None) and (state == False):
+                self.handle_key(key_pressed)
+                state = True
+            elif key_pressed == None:
+                state = False
+            n = self.mailbox.get(self.card_buf)
+            if n:
+                rfid_card = str(int.from_bytes(bytes(self.card_buf[:n]),"little",False))
+                if rfid_card in self.players_rfid.keys() and self.players_rfid[rfid_card] < self.players_count:
+                    self.handle_card(self.players_rfid[rfid_card])
+                else:
+                    # for "card<N>=<uid>" lines in config.txt
+                    print(f"card {rfid_card}")
+            if self.pages > 1 and self.state_game == "" and self.rows_cache != None \
+                    and time.ticks_diff(time.ticks_ms(), self.page_time) > SCROLL_MS:
+                self.page_time = time.ticks_ms()
+                self.show_score_all((self.page + 1) % self.pages)
+            self.poll_serial()
+
+    def poll_serial(self):
+        # text commands on the USB serial, one per line
+        for _ in self.serial.ipoll(0):
+            char = sys.stdin.read(1)
+            if char == "\n" or char == "\r":
+                if self.command != "":
+                    self.run_command(self.command)
+                self.command = ""
+            elif len(self.command) < 32:
+                self.command = self.command + char
+
+    def run_command(self, command):
+        # "DUMP" or "DUMP <first record>": header, balances, ledger and end frames
+        # "STATS": RFID SPI clock and link error counters as a text line
+        # unknown or malformed commands get a text error line, the host
+        # tool skips text between frames
+        parts = command.split()
+        if len(parts) == 0:
+            return
+        try:
+            if parts[0] == "DUMP":
+                first = int(parts[1]) if len(parts) > 1 else 0
+                if first < 0:
+                    raise ValueError
+                self.send_dump(first)
+            elif parts[0] == "STATS":
+                self.send_stats()
+            else:
+                print(f"error: unknown command {parts[0]}")
+        except ValueError:
+            print(f"error: bad command {command}")
+
+    def send_stats(self):
+        # the reader is created by the RFID thread, counters are only read here
+        reader = self.rfid_reader
+        if reader == None:
+            print("rfid: not ready")
+            return
+        stats = reader.link_stats()
+        print(f"rfid: spi={reader.baudrate}", " ".join(f"{key}={stats[key]}" for key in stats))
+
+    def send_frame(self, kind, payload):
+        out = sys.stdout.buffer
+        self.frame_head[0] = ord("M")
+        self.frame_head[1] = ord("B")
+        struct.pack_into("<BH", self.frame_head, 2, kind, len(payload))
+        struct.pack_into("<I", self.frame_crc, 0, crc32(payload, crc32(memoryview(self.frame_head)[2:])))
+        out.write(self.frame_head)
+        out.write(payload)
+        out.write(self.frame_crc)
+
+    def send_dump(self, first):
+        # the ledger is streamed in LEDGER_CHUNK pieces, never loaded whole
+        self.send_frame(FRAME_HEADER, struct.pack("<BBBII", LEDGER_VERSION, LEDGER_RECORD,
+                                                  self.players_count, self.ledger.count, time.time()))
+        self.send_frame(FRAME_SNAPSHOT, bytes(self.players))
+        sent = 0
+        try:
+            with open(self.ledger.path, 'rb') as f:
+                f.seek(first * LEDGER_RECORD)
+                chunk = memoryview(self.chunk)
+                while True:
+                    n = f.readinto(self.chunk)
+                    n = n - n % LEDGER_RECORD if n else 0
+                    if n == 0:
+                        break
+                    self.send_frame(FRAME_LEDGER, chunk[:n])
+                    sent += n // LEDGER_RECORD
+                    if self.wdt != None:
+                        self.wdt.feed()
+        except OSError:
+            pass
+        self.send_frame(FRAME_END, struct.pack("<I", sent))
+    
+    def show_score_all(self, page=None):
+        if page == None:
+            page = self.page
+        if self.rows_cache == None or page != self.page:
+            self.clear_screen()
+            self.rows_cache = [None] * self.rows
+            self.page = page
+            first = 0
+            last = self.rows - 1
+        else:
+            first = self.rows
+            last = -1
+        wide = self.players_count > 9
+        for row in range(0, self.rows):
+            i = page * self.rows + row
+            text = ""
+            if i < self.players_count:
+                text = f"{i+1}: {self.players[i]}"
+                if wide and i < 9:
+                    text = " " + text
+            if text == self.rows_cache[row]:
+                continue
+            # redraw only rows whose text changed
+            self.rows_cache[row] = text
+            self.oled.fill_rect(0, row*8, self.oled_width, 8, 0)
+            self.oled.text(text, 0, row*8)
+            first = min(first, row)
+            last = max(last, row)
+        if first == 0 and last == self.rows - 1:
+            self.oled.show()
+        elif first <= last:
+            self.oled.show_pages(first, last)
+    
+    def show_stats(self, page):
+        # Per player a 16px band: number, net flow and max on the first line,
+        # sparkline of the history and min on the second. Newest sample is
+        # at the right edge. Only sample() is allocation free, the text of
+        # each row is formatted on every redraw, which happens on 'D' only.
+        self.clear_screen()
+        self.stats_page = page
+        count = self.history_count
+        oldest = (self.history_head - count) % HISTORY
+        for row in range(0, STATS_ROWS):
+            i = page * STATS_ROWS + row
+            if i >= self.players_count or count == 0:
+                break
+            base = i * HISTORY
+            lo = hi = self.history[base + oldest]
+            for j in range(1, count):
+                value = self.history[base + (oldest + j) % HISTORY]
+                if value < lo:
+                    lo = value
+                elif value > hi:
+                    hi = value
+            first = self.history[base + oldest]
+            last = self.history[base + (oldest + count - 1) % HISTORY]
+            y = row * 16
+            self.oled.text(f"{i+1:>2} {last - first:+6d} {hi:>6}", 0, y)
+            self.oled.text(f"{lo:>6}", HISTORY, y + 8)
+            # sparkline, 7px high, consecutive samples joined by vlines
+            bottom = y + 15
+            prev = -1
+            for j in range(0, count):
+                value = self.history[base + (oldest + j) % HISTORY]
+                if hi > lo:
+                    py = bottom - (value - lo) * 6 // (hi - lo)
+                else:
+                    py = bottom - 3
+                if prev < 0:
+                    prev = py
+                x = HISTORY - count + j
+                self.oled.vline(x, min(py, prev), abs(py - prev) + 1, 1)
+                prev = py
+        self.oled.show()
+
+    def clear_screen(self):
+        self.rows_cache = None
+        self.stats_page = -1
+        self.entry_shown = False
+        self.oled.fill(0)
+
+    def write_big(self, text, y, size):
+        if not self.oled.write_font(self.fonts[size], text, 0, y):
+            self.oled.write_text(text, 0, y, size)
+
+    def show_score_one(self, player):
+        self.clear_screen()
+        if self.players[player] > 99999:
+            self.write_big(f"{self.players[player]}", 24, 2)
+        else:    
+            self.write_big(f"{self.players[player]}", 24, 3)
+        self.oled.show()
+        
+    def show_score_one_number(self, number):
+        self.clear_screen()
+        if number > 99999:
+            self.write_big(str(number), 24, 2)
+        else:    
+            self.write_big(str(number), 24, 3)
+        self.oled.show()
+    
+    def show_entry(self, text):
+        # typing changes only the text band, pages 3-5, flush just those
+        if self.entry_shown:
+            self.oled.fill_rect(0, 24, self.oled_width, 24, 0)
+            self.write_big(text, 26, 2)
+            self.oled.show_pages(3, 5)
+        else:
+            self.clear_screen()
+            self.write_big(text, 26, 2)
+            self.oled.show()
+            self.entry_shown = True
+
+    def show_trade(self, number):
+        self.show_entry(f"T{number}")
+    
+    def show_plus(self, number):
+        self.show_entry(f"+{number}")
+    
+    def show_minus(self, number):
+        self.show_entry(f"-{number}")
+    
+    def show_not_enough(self, number):
+        self.clear_screen()
+        if int(self.number[:-1]) > 9999:
+            self.oled.write_text(f"NO {number}", 0, 26, 1)
+        else:
+            self.write_big(f"NO {number}", 26, 2)
+        self.oled.show()
+
+
+def main():
+    game = Game()
+    game.run_game()
@@ -0,0 +1,6 @@
+# Frozen modules for a custom rp2 firmware build:
+#   make -C ports/rp2 BOARD=RPI_PICO FROZEN_MANIFEST=/path/to/monopoly/manifest.py
+include("$(PORT_DIR)/boards/manifest.py")
+module("bank.py")
+module("mfrc522.py")
+module("keypad.py")
@@ -2,6 +2,7 @@
 
 from machine import Pin, SPI
 from os import uname
+from binascii import hexlify
 
 
 class MFRC522:
@@ -19,9 +20,12 @@ class MFRC522:
     PICC_ANTICOLL1 = 0x93
     PICC_ANTICOLL2 = 0x95
     PICC_ANTICOLL3 = 0x97
+
+    # SPI clock steps tried by calibrate(), the chip is rated up to 10 MHz
+    BAUDRATES = (1000000, 2000000, 4000000, 6000000, 8000000, 10000000)
   
 
-    def __init__(self, sck, mosi, miso, rst, cs,baudrate=1000000,spi_id=0):
+    def __init__(self, sck, mosi, miso, rst, cs,baudrate=1000000,spi_id=0,init=True):
 
         self.sck = Pin(sck, Pin.OUT)
         self.mosi = Pin(mosi, Pin.OUT)
@@ -31,38 +35,104 @@ class MFRC522:
 
         self.rst.value(0)
         self.cs.value(1)
+
+        # sector authenticated in the current Crypto1 session, -1 if none
+        self.auth_sector = -1
+        self.auth_uid = None
+        self.auth_key = None
+        # 1K Classic image, allocated on first use
+        self.classic_buf = None
         
+        # transaction results, error classes are the ErrorReg bits
+        self.stats = {"ok": 0, "notag": 0, "timeout": 0, "protocol": 0, "parity": 0,
+                      "crc": 0, "collision": 0, "overflow": 0}
+        self._wbuf = bytearray(2)
+        self._rbuf = bytearray(1)
+
         board = uname()[0]
+        self.board = board
 
         if board == 'WiPy' or board == 'LoPy' or board == 'FiPy':
+            self.baudrate = 1000000
             self.spi = SPI(0)
             self.spi.init(SPI.MASTER, baudrate=1000000, pins=(self.sck, self.mosi, self.miso))
         elif (board == 'esp8266') or (board == 'esp32'):
+            self.baudrate = 100000
             self.spi = SPI(baudrate=100000, polarity=0, phase=0, sck=self.sck, mosi=self.mosi, miso=self.miso)
             self.spi.init()
         elif board == 'rp2':
+            self.baudrate = baudrate
             self.spi = SPI(spi_id,baudrate=baudrate,sck=self.sck, mosi= self.mosi, miso= self.miso)
         else:
             raise RuntimeError("Unsupported platform")
 
         self.rst.value(1)
-        self.init()
+        # the chip just left hard reset, a soft reset on top is redundant.
+        # init=False leaves the chip to calibrate(), which initializes it
+        # after picking the clock.
+        if init:
+            self.init(reset=False)
 
     def _wreg(self, reg, val):
 
+        self._wbuf[0] = (reg << 1) & 0x7e
+        self._wbuf[1] = 0xff & val
         self.cs.value(0)
-        self.spi.write(b'%c' % int(0xff & ((reg << 1) & 0x7e)))
-        self.spi.write(b'%c' % int(0xff & val))
+        self.spi.write(self._wbuf)
         self.cs.value(1)
 
     def _rreg(self, reg):
 
+        self._rbuf[0] = ((reg << 1) & 0x7e) | 0x80
         self.cs.value(0)
-        self.spi.write(b'%c' % int(0xff & (((reg << 1) & 0x7e) | 0x80)))
-        val = self.spi.read(1)
+        self.spi.write(self._rbuf)
+        self.spi.readinto(self._rbuf)
         self.cs.value(1)
 
-        return val[0]
+        return self._rbuf[0]
+
+    def _set_baudrate(self, baudrate):
+
+        if self.board == 'WiPy' or self.board == 'LoPy' or self.board == 'FiPy':
+            self.spi.init(SPI.MASTER, baudrate=baudrate, pins=(self.sck, self.mosi, self.miso))
+        else:
+            self.spi.init(baudrate=baudrate)
+        self.baudrate = baudrate
+
+    def _check_link(self, tries):
+
+        # TReloadRegL is a plain read/write register, init() restores it
+        for _ in range(tries):
+            for pattern in (0x55, 0xAA, 0x00, 0xFF, 0x3C, 0xC3):
+                self._wreg(0x2D, pattern)
+                if self._rreg(0x2D) != pattern:
+                    return False
+        return True
+
+    def calibrate(self, max_baudrate=10000000, tries=8):
+        # Raise the SPI clock step by step while register read-back stays
+        # intact, settle on the fastest reliable step and reinitialize the
+        # chip since a failing step may have garbled other registers.
+        best = self.baudrate
+        for baudrate in self.BAUDRATES:
+            if baudrate > max_baudrate:
+                break
+            if baudrate <= best:
+                continue
+            self._set_baudrate(baudrate)
+            if not self._check_link(tries):
+                break
+            best = baudrate
+        self._set_baudrate(best)
+        self.init()
+        return best
+
+    def link_stats(self):
+        return dict(self.stats)
+
+    def reset_stats(self):
+        for key in self.stats:
+            self.stats[key] = 0
 
     def _sflags(self, reg, mask):
         self._wreg(reg, self._rreg(reg) | mask)
@@ -99,17 +169,22 @@ class MFRC522:
         while True:
             n = self._rreg(0x04)
             i -= 1
-            if ~((i != 0) and ~(n & 0x01) and ~(n & wait_irq)):
+            # done when the command finishes, the timer runs out (no tag) or
+            # the counter does (the chip is not answering)
+            if not ((i != 0) and not (n & 0x01) and not (n & wait_irq)):
                 break
 
         self._cflags(0x0D, 0x80)
 
         if i:
-            if (self._rreg(0x06) & 0x1B) == 0x00:
+            err = self._rreg(0x06)
+            if (err & 0x1B) == 0x00:
                 stat = self.OK
 
-                if n & irq_en & 0x01:
+                # timer ran out: no tag for transceive, no answer to auth
+                if n & irq_en & 0x01 or (n & 0x01 and not (n & wait_irq)):
                     stat = self.NOTAGERR
+                    self.stats["notag"] += 1
                 elif cmd == 0x0C:
                     n = self._rreg(0x0A)
                     lbits = self._rreg(0x0C) & 0x07
@@ -125,8 +200,23 @@ class MFRC522:
 
                     for _ in range(n):
                         recv.append(self._rreg(0x09))
+                if stat == self.OK:
+                    self.stats["ok"] += 1
             else:
                 stat = self.ERR
+            if err & 0x01:
+                self.stats["protocol"] += 1
+            if err & 0x02:
+                self.stats["parity"] += 1
+            if err & 0x04:
+                self.stats["crc"] += 1
+            if err & 0x08:
+                self.stats["collision"] += 1
+            if err & 0x10:
+                self.stats["overflow"] += 1
+        else:
+            # the chip never raised an interrupt
+            self.stats["timeout"] += 1
 
         return stat, recv, bits
 
@@ -149,9 +239,10 @@ class MFRC522:
 
         return [self._rreg(0x22), self._rreg(0x21)]
 
-    def init(self):
+    def init(self, reset=True):
 
-        self.reset()
+        if reset:
+            self.reset()
         self._wreg(0x2A, 0x8D)
         self._wreg(0x2B, 0x3E)
         self._wreg(0x2D, 30)
@@ -172,6 +263,8 @@ class MFRC522:
 
     def request(self, mode):
 
+        # a new request starts a new card session
+        self.auth_sector = -1
         self._wreg(0x0D, 0x07)
         (stat, recv, bits) = self._tocard(0x0C, [mode])
 
@@ -306,9 +399,28 @@ class MFRC522:
         elif keyB is not None:
             status = self.auth(self.AUTHENT1B, addr, keyB, uid)
         return status
-       
+
+    def authSector(self, uid, sector, keyA=None, keyB=None):
+        # authenticate once per sector, following blocks of the same sector
+        # with the same uid and key reuse the Crypto1 session. Key A and key
+        # B can grant different access, so the key type is part of the match.
+        if keyA is not None:
+            key = (self.AUTHENT1A, keyA)
+        else:
+            key = (self.AUTHENT1B, keyB)
+        if self.auth_sector == sector and self.auth_uid == uid and self.auth_key == key:
+            return self.OK
+        status = self.authKeys(uid, sector * 4 + 3, keyA, keyB)
+        if status == self.OK:
+            self.auth_sector = sector
+            self.auth_uid = uid
+            self.auth_key = key
+        else:
+            self.auth_sector = -1
+        return status
 
     def stop_crypto1(self):
+        self.auth_sector = -1
         self._cflags(0x08, 0x08)
 
     def read(self, addr):
@@ -343,40 +455,62 @@ class MFRC522:
             return self.ERR
         if len(data) != 16:
             return self.ERR
-        if self.authKeys(uid,absoluteBlock,keyA,keyB) != self.ERR :
-            return self.write(absoluteBlock, data)
+        if self.authSector(uid,sector,keyA,keyB) == self.OK :
+            status = self.write(absoluteBlock, data)
+            if status != self.OK:
+                # the card drops the session after an error
+                self.auth_sector = -1
+            return status
         return self.ERR
 
     def readSectorBlock(self,uid ,sector, block, keyA=None, keyB = None):
         absoluteBlock =  sector * 4 + (block % 4)
         if absoluteBlock > 63 :
             return self.ERR, None
-        if self.authKeys(uid,absoluteBlock,keyA,keyB) != self.ERR :
-            return self.read(absoluteBlock)
+        if self.authSector(uid,sector,keyA,keyB) == self.OK :
+            status, data = self.read(absoluteBlock)
+            if status != self.OK:
+                self.auth_sector = -1
+            return status, data
         return self.ERR, None
 
+    def iterClassic1K(self, uid, Start=0, End=64, keyA=None, keyB=None):
+        # yields (sector, block, memoryview of the 16 block bytes), blocks of
+        # one sector are read back-to-back after a single authentication into
+        # classic_buf. Stops early on an authentication or read error.
+        if self.classic_buf is None:
+            self.classic_buf = bytearray(1024)
+        buf = self.classic_buf
+        mv = memoryview(buf)
+        for absoluteBlock in range(Start, min(End, 64)):
+            sector = absoluteBlock // 4
+            if self.authSector(uid, sector, keyA, keyB) != self.OK:
+                return
+            status, block = self.read(absoluteBlock)
+            if status != self.OK or len(block) != 16:
+                self.auth_sector = -1
+                return
+            offset = absoluteBlock * 16
+            for i in range(16):
+                buf[offset + i] = block[i]
+            yield sector, absoluteBlock % 4, mv[offset:offset + 16]
+
+    def readClassic1K(self, uid, Start=0, End=64, keyA=None, keyB=None):
+        # fills classic_buf with blocks Start..End-1, returns (status, memoryview)
+        last = Start - 1
+        for sector, block, _ in self.iterClassic1K(uid, Start, End, keyA, keyB):
+            last = sector * 4 + block
+        if last != min(End, 64) - 1:
+            return self.ERR, None
+        return self.OK, memoryview(self.classic_buf)[Start * 16:End * 16]
+
     def MFRC522_DumpClassic1K(self,uid, Start=0, End=64, keyA=None, keyB=None):
-        for absoluteBlock in range(Start,End):
-            status = self.authKeys(uid,absoluteBlock,keyA,keyB)
-            # Check if authenticated
-            print("{:02d} S{:02d} B{:1d}: ".format(absoluteBlock, absoluteBlock//4 , absoluteBlock % 4),end="")
-            if status == self.OK:                    
-                status, block = self.read(absoluteBlock)
-                if status == self.ERR:
-                    break
-                else:
-                    for value in block:
-                        print("{:02X} ".format(value),end="")
-                    print("  ",end="")
-                    for value in block:
-                        if (value > 0x20) and (value < 0x7f):
-                            print(chr(value),end="")
-                        else:
-                            print('.',end="")
-                    print("")
-            else:
-                break
-        if status == self.ERR:
-            print("Authentication error")
+        last = Start - 1
+        for sector, block, data in self.iterClassic1K(uid, Start, End, keyA, keyB):
+            last = sector * 4 + block
+            text = "".join(chr(value) if (value > 0x20) and (value < 0x7f) else "." for value in data)
+            print("{:02d} S{:02d} B{:1d}: {}   {}".format(last, sector, block, hexlify(data, " ").decode().upper(), text))
+        if last != min(End, 64) - 1:
+            print("{:02d} S{:02d} B{:1d}: Authentication error".format(last + 1, (last + 1) // 4, (last + 1) % 4))
             return self.ERR
         return self.OK
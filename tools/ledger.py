@@ -0,0 +1,225 @@
+"""Pull the game ledger from the bank over USB serial and turn it into tables.
+
+Runs on the host with CPython:
+
+    python tools/ledger.py pull /dev/ttyACM0 night.bin
+    python tools/ledger.py export night*.bin -o tables
+
+`pull` needs pyserial and saves the raw frame stream, `export` decodes any
+number of saved streams into transactions.csv, snapshots.csv, games.csv and
+players.csv. With --parquet it also writes .parquet next to each table, which
+needs pandas and pyarrow.
+
+Stream format, little endian, see bank.Game.send_dump:
+    frame: b"MB", type u8, payload length u16, payload, crc32 u32 of type,
+    length and payload
+    1 header: version u8, record size u8, players u8, records u32, time u32
+    2 snapshot: players * balance i32
+    3 ledger: records of index u32, time u32, amount i32, op u8, a u8, b u8,
+      keys u8
+    4 end: records sent u32
+"""
+
+import argparse
+import csv
+import os
+import struct
+import sys
+import time
+import zlib
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+MAGIC = b"MB"
+FRAME_HEADER = 1
+FRAME_SNAPSHOT = 2
+FRAME_LEDGER = 3
+FRAME_END = 4
+
+RECORD = struct.Struct("<IIiBBBB")
+OPS = {2: "plus", 3: "minus", 4: "trade", 5: "reset"}
+
+
+class DumpError(Exception):
+    pass
+
+
+def iter_frames(data):
+    # (type, payload) for every frame with a valid crc, other serial output
+    # between frames (boot and tx lines) is skipped
+    i = 0
+    while True:
+        i = data.find(MAGIC, i)
+        if i < 0 or i + 5 > len(data):
+            return
+        kind, length = struct.unpack_from("<BH", data, i + 2)
+        end = i + 5 + length + 4
+        # "MB" in text output or a truncated frame, resync at the next magic
+        if end > len(data) or zlib.crc32(data[i + 2:end - 4]) != struct.unpack_from("<I", data, end - 4)[0]:
+            i += 1
+            continue
+        yield kind, data[i + 5:end - 4]
+        i = end
+
+
+def decode(data):
+    dump = {"header": None, "balances": [], "records": [], "sent": None}
+    for kind, payload in iter_frames(data):
+        if kind == FRAME_HEADER:
+            version, record_size, players, count, timestamp = struct.unpack("<BBBII", payload)
+            if record_size != RECORD.size:
+                raise DumpError(f"record size {record_size}, expected {RECORD.size}")
+            dump["header"] = {"version": version, "players": players, "records": count, "time": timestamp}
+        elif kind == FRAME_SNAPSHOT:
+            dump["balances"] = list(struct.unpack(f"<{len(payload) // 4}i", payload))
+        elif kind == FRAME_LEDGER:
+            for index, timestamp, amount, op, a, b, keys in RECORD.iter_unpack(payload):
+                if op:
+                    dump["records"].append({"index": index, "time": timestamp, "op": OPS.get(op, op),
+                                            "amount": amount, "a": a, "b": b, "keys": keys})
+        elif kind == FRAME_END:
+            (dump["sent"],) = struct.unpack("<I", payload)
+    if dump["header"] is None or dump["sent"] is None:
+        raise DumpError("incomplete dump, no header or end frame")
+    return dump
+
+
+def pull(port, first=0, idle=1.0):
+    if serial is None:
+        raise SystemExit("pull needs pyserial: pip install pyserial")
+    data = bytearray()
+    with serial.Serial(port, 115200, timeout=idle) as link:
+        link.reset_input_buffer()
+        link.write(f"DUMP {first}\n".encode())
+        while True:
+            chunk = link.read(4096)
+            if not chunk:
+                break
+            data += chunk
+    return bytes(data)
+
+
+def games(source, dump):
+    # split the ledger into games at reset records
+    game_rows = []
+    player_rows = []
+    game = None
+
+    def close(game):
+        if game is None:
+            return
+        game_rows.append({k: v for k, v in game.items() if k != "flows"})
+        for player, (received, paid, count) in sorted(game["flows"].items()):
+            player_rows.append({"source": source, "game": game["game"], "player": player + 1,
+                                "received": received, "paid": paid, "net": received - paid,
+                                "transactions": count})
+
+    def flow(game, player, amount):
+        received, paid, count = game["flows"].get(player, (0, 0, 0))
+        if amount >= 0:
+            received += amount
+        else:
+            paid -= amount
+        game["flows"][player] = (received, paid, count + 1)
+
+    for record in dump["records"]:
+        if game is None or record["op"] == "reset":
+            close(game)
+            game = {"source": source, "game": len(game_rows), "start": record["time"], "end": record["time"],
+                    "players": record["a"] if record["op"] == "reset" else dump["header"]["players"],
+                    "start_balance": record["amount"] if record["op"] == "reset" else None,
+                    "transactions": 0, "volume": 0, "keys": 0, "flows": {}}
+            if record["op"] == "reset":
+                continue
+        game["end"] = record["time"]
+        game["transactions"] += 1
+        game["volume"] += record["amount"]
+        game["keys"] += record["keys"]
+        if record["op"] == "plus":
+            flow(game, record["a"], record["amount"])
+        elif record["op"] == "minus":
+            flow(game, record["a"], -record["amount"])
+        elif record["op"] == "trade":
+            flow(game, record["a"], -record["amount"])
+            flow(game, record["b"], record["amount"])
+    close(game)
+    for row in game_rows:
+        row["keys_per_transaction"] = round(row["keys"] / row["transactions"], 2) if row["transactions"] else 0
+    return game_rows, player_rows
+
+
+def write_table(directory, name, rows, parquet):
+    path = os.path.join(directory, name + ".csv")
+    fields = []
+    for row in rows:
+        fields += [k for k in row if k not in fields]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    if parquet and rows:
+        pandas.DataFrame(rows).to_parquet(os.path.join(directory, name + ".parquet"))
+
+
+def export(paths, directory, parquet=False):
+    if parquet and pandas is None:
+        raise SystemExit("parquet output needs pandas and pyarrow")
+    os.makedirs(directory, exist_ok=True)
+    transactions, snapshots, game_rows, player_rows = [], [], [], []
+    for path in paths:
+        source = os.path.basename(path)
+        with open(path, "rb") as f:
+            try:
+                dump = decode(f.read())
+            except DumpError as e:
+                print(f"{path}: {e}", file=sys.stderr)
+                continue
+        for record in dump["records"]:
+            transactions.append(dict(source=source, **record))
+        for player, balance in enumerate(dump["balances"]):
+            snapshots.append({"source": source, "time": dump["header"]["time"], "player": player + 1,
+                              "balance": balance})
+        g, p = games(source, dump)
+        game_rows += g
+        player_rows += p
+    write_table(directory, "transactions", transactions, parquet)
+    write_table(directory, "snapshots", snapshots, parquet)
+    write_table(directory, "games", game_rows, parquet)
+    write_table(directory, "players", player_rows, parquet)
+    print(f"{len(paths)} dumps, {len(transactions)} transactions, {len(game_rows)} games -> {directory}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    pull_parser = commands.add_parser("pull", help="save the raw dump of a connected bank")
+    pull_parser.add_argument("port")
+    pull_parser.add_argument("output")
+    pull_parser.add_argument("--first", type=int, default=0, help="first ledger record to send")
+    export_parser = commands.add_parser("export", help="decode saved dumps into tables")
+    export_parser.add_argument("dumps", nargs="+")
+    export_parser.add_argument("-o", "--output", default=".")
+    export_parser.add_argument("--parquet", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "pull":
+        started = time.time()
+        data = pull(args.port, args.first)
+        dump = decode(data)
+        with open(args.output, "wb") as f:
+            f.write(data)
+        print(f"{args.output}: {len(dump['records'])} records in {time.time() - started:.1f}s")
+    else:
+        export(args.dumps, args.output, args.parquet)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
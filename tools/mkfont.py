@@ -0,0 +1,134 @@
+"""Rasterize a TTF into the font asset format read by bank.Font.
+
+Runs on the host with CPython and Pillow:
+
+    python tools/mkfont.py DejaVuSans-Bold.ttf 16 font16.bin
+    python tools/mkfont.py DejaVuSans-Bold.ttf 24 font24.bin
+
+--check reads the written file back with bank.Font and compares every drawn
+glyph with the Pillow rendering, so a format mismatch shows up on the host
+instead of as garbage on the OLED.
+
+Format, little endian:
+    b"MF", version (u8), height in px (u8, multiple of 8), glyph count (u8)
+    count * (char code u8, advance width u8, data offset u16)
+    glyph data: height // 8 pages, each page is `width` MONO_VLSB column
+    bytes, the same layout as the SSD1306 buffer
+"""
+
+import argparse
+import ast
+import os
+import struct
+import sys
+
+from PIL import Image, ImageDraw, ImageFont
+
+VERSION = 1
+CHARS = "0123456789+- ANOT"
+
+
+def fit_font(path, height, chars):
+    # largest point size whose glyphs fit into `height` rows
+    size = height
+    while size > 4:
+        font = ImageFont.truetype(path, size)
+        top = min(font.getbbox(c)[1] for c in chars if c != " ")
+        bottom = max(font.getbbox(c)[3] for c in chars if c != " ")
+        if bottom - top <= height:
+            return font, top
+        size -= 1
+    raise SystemExit(f"{path}: no size fits into {height} px")
+
+
+def render(font, top, height, char):
+    width = max(1, round(font.getlength(char)) + 1)
+    image = Image.new("1", (width, height), 0)
+    ImageDraw.Draw(image).text((0, -top), char, font=font, fill=1)
+    return image
+
+
+def rasterize(font, top, height, char):
+    image = render(font, top, height, char)
+    width = image.width
+    pixels = image.load()
+    data = bytearray()
+    for page in range(height // 8):
+        for x in range(width):
+            byte = 0
+            for bit in range(8):
+                if pixels[x, page * 8 + bit]:
+                    byte |= 1 << bit
+            data.append(byte)
+    return width, bytes(data)
+
+
+def build(path, height, chars=CHARS):
+    if height % 8 or not 8 <= height <= 64:
+        raise SystemExit("height must be a multiple of 8 up to 64")
+    font, top = fit_font(path, height, chars)
+    index = bytearray()
+    data = bytearray()
+    for char in chars:
+        width, glyph = rasterize(font, top, height, char)
+        index += struct.pack("<BBH", ord(char), width, len(data))
+        data += glyph
+    return b"MF" + struct.pack("<BBB", VERSION, height, len(chars)) + bytes(index) + bytes(data)
+
+
+def load_font_class():
+    # bank.py imports machine and friends, take only the Font class from it
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bank.py")
+    with open(path) as f:
+        source = f.read()
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.ClassDef) and node.name == "Font":
+            namespace = {}
+            exec(ast.get_source_segment(source, node), namespace)
+            return namespace["Font"]
+    raise SystemExit(f"{path}: no Font class")
+
+
+def check(asset_path, ttf, height, chars=CHARS):
+    # draw the whole string with bank.Font into a buffer as wide as the text
+    # and compare every pixel with the glyphs rendered by Pillow
+    font = load_font_class()(asset_path)
+    if not font.has(chars):
+        raise SystemExit(f"{asset_path}: bank.Font can not load all glyphs")
+    source, top = fit_font(ttf, height, chars)
+    images = [render(source, top, height, char) for char in chars]
+    width = sum(image.width for image in images)
+    pages = height // 8
+    buffer = bytearray(width * pages)
+    if font.draw(buffer, width, pages, chars, 0, 0) != width:
+        raise SystemExit(f"{asset_path}: advance widths do not match")
+    x = 0
+    for char, image in zip(chars, images):
+        pixels = image.load()
+        for column in range(image.width):
+            for y in range(height):
+                drawn = buffer[(y // 8) * width + x + column] >> (y % 8) & 1
+                if drawn != (1 if pixels[column, y] else 0):
+                    raise SystemExit(f"{asset_path}: {char!r} differs at {column},{y}")
+        x += image.width
+    print(f"{asset_path}: {len(chars)} glyphs match bank.Font")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("ttf")
+    parser.add_argument("height", type=int)
+    parser.add_argument("output")
+    parser.add_argument("--chars", default=CHARS)
+    parser.add_argument("--check", action="store_true", help="read the asset back with bank.Font")
+    args = parser.parse_args(argv)
+    asset = build(args.ttf, args.height, args.chars)
+    with open(args.output, "wb") as f:
+        f.write(asset)
+    print(f"{args.output}: {len(args.chars)} glyphs, {len(asset)} bytes")
+    if args.check:
+        check(args.output, args.ttf, args.height, args.chars)
+
+
+if __name__ == "__main__":
+    sys.exit(main())